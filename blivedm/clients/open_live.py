@@ -1,16 +1,17 @@
 # -*- coding: utf-8 -*-
 import asyncio
-import datetime
 import hashlib
 import hmac
 import json
 import logging
 import random
+import time
 from typing import *
 
 import aiohttp
 
 from . import ws_base
+from .. import utils
 
 __all__ = (
     'OpenLiveClient',
@@ -22,6 +23,12 @@ START_URL = 'https://live-open.biliapi.com/v2/app/start'
 HEARTBEAT_URL = 'https://live-open.biliapi.com/v2/app/heartbeat'
 END_URL = 'https://live-open.biliapi.com/v2/app/end'
 
+STATIC_HEADERS = {
+    'Content-Type': 'application/json',
+    'Accept': 'application/json',
+}
+"""不参与签名的固定请求头"""
+
 
 class OpenLiveClient(ws_base.WebSocketClientBase):
     """
@@ -53,6 +60,8 @@ class OpenLiveClient(ws_base.WebSocketClientBase):
 
         self._access_key = access_key
         self._access_secret = access_secret
+        self._access_secret_bytes = access_secret.encode('utf-8')
+        """编码好的access_secret，签名时直接用hmac.digest走C实现"""
         self._app_id = app_id
         self._room_owner_auth_code = room_owner_auth_code
         self._game_heartbeat_interval = game_heartbeat_interval
@@ -64,18 +73,24 @@ class OpenLiveClient(ws_base.WebSocketClientBase):
         """弹幕服务器URL列表"""
         self._auth_body: Optional[str] = None
         """连接弹幕服务器用的认证包内容"""
+        self._auth_packet: Optional[bytes] = None
+        """根据_auth_body生成的认证包，_auth_body更新时清空"""
         self._game_id: Optional[str] = None
         """项目场次ID，仅用于互动玩法类项目，其他项目为空字符串"""
+        self._heartbeat_body_bytes: Optional[bytes] = None
+        """项目心跳包的请求体，game_id确定后就不会变"""
+        self._heartbeat_body_md5: Optional[str] = None
+        """项目心跳包请求体的MD5"""
 
         # 在运行时初始化的字段
         self._websocket: Optional[aiohttp.ClientWebSocketResponse] = None
         """WebSocket连接"""
         self._network_future: Optional[asyncio.Future] = None
         """网络协程的future"""
-        self._heartbeat_timer_handle: Optional[asyncio.TimerHandle] = None
-        """发连接心跳包定时器的handle"""
-        self._game_heartbeat_timer_handle: Optional[asyncio.TimerHandle] = None
-        """发项目心跳包定时器的handle"""
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        """定时发连接心跳包的协程"""
+        self._game_heartbeat_task: Optional[asyncio.Task] = None
+        """定时发项目心跳包的协程"""
 
     @property
     def room_owner_uid(self) -> Optional[int]:
@@ -112,35 +127,41 @@ class OpenLiveClient(ws_base.WebSocketClientBase):
         if self.is_running:
             logger.warning('room=%s is calling close(), but client is running', self.room_id)
 
-        if self._game_heartbeat_timer_handle is not None:
-            self._game_heartbeat_timer_handle.cancel()
-            self._game_heartbeat_timer_handle = None
+        if self._game_heartbeat_task is not None:
+            self._game_heartbeat_task.cancel()
+            try:
+                await self._game_heartbeat_task
+            except asyncio.CancelledError:
+                pass
+            except Exception:  # noqa
+                logger.exception('room=%s _game_heartbeat_loop() finished with exception:', self.room_id)
+            self._game_heartbeat_task = None
         await self._end_game()
 
         await super().close()
 
     def _request_open_live(self, url, body: dict):
         body_bytes = json.dumps(body).encode('utf-8')
+        return self._request_open_live_raw(url, body_bytes, hashlib.md5(body_bytes).hexdigest())
+
+    def _request_open_live_raw(self, url, body_bytes: bytes, body_md5: str):
         headers = {
             'x-bili-accesskeyid': self._access_key,
-            'x-bili-content-md5': hashlib.md5(body_bytes).hexdigest(),
+            'x-bili-content-md5': body_md5,
             'x-bili-signature-method': 'HMAC-SHA256',
-            'x-bili-signature-nonce': str(random.randint(0, 999999999)),
+            'x-bili-signature-nonce': str(random.getrandbits(30)),
             'x-bili-signature-version': '1.0',
-            'x-bili-timestamp': str(int(datetime.datetime.now().timestamp())),
+            'x-bili-timestamp': str(int(time.time())),
         }
 
         str_to_sign = '\n'.join(
             f'{key}:{value}'
             for key, value in headers.items()
         )
-        signature = hmac.new(
-            self._access_secret.encode('utf-8'), str_to_sign.encode('utf-8'), hashlib.sha256
-        ).hexdigest()
+        signature = hmac.digest(self._access_secret_bytes, str_to_sign.encode('utf-8'), 'sha256').hex()
         headers['Authorization'] = signature
 
-        headers['Content-Type'] = 'application/json'
-        headers['Accept'] = 'application/json'
+        headers.update(STATIC_HEADERS)
         return self._session.post(url, headers=headers, data=body_bytes)
 
     async def init_room(self):
@@ -152,10 +173,8 @@ class OpenLiveClient(ws_base.WebSocketClientBase):
         if not await self._start_game():
             return False
 
-        if self._game_id != '' and self._game_heartbeat_timer_handle is None:
-            self._game_heartbeat_timer_handle = asyncio.get_running_loop().call_later(
-                self._game_heartbeat_interval, self._on_send_game_heartbeat
-            )
+        if self._game_id != '' and self._game_heartbeat_task is None:
+            self._game_heartbeat_task = asyncio.create_task(self._game_heartbeat_loop())
         return True
 
     async def _start_game(self):
@@ -167,7 +186,7 @@ class OpenLiveClient(ws_base.WebSocketClientBase):
                 if res.status != 200:
                     logger.warning('init_room() failed, status=%d, reason=%s', res.status, res.reason)
                     return False
-                data = await res.json()
+                data = await utils.read_json(res)
                 if data['code'] != 0:
                     logger.warning('init_room() failed, code=%d, message=%s, request_id=%s',
                                    data['code'], data['message'], data['request_id'])
@@ -181,8 +200,11 @@ class OpenLiveClient(ws_base.WebSocketClientBase):
 
     def _parse_start_game(self, data):
         self._game_id = data['game_info']['game_id']
+        self._heartbeat_body_bytes = json.dumps({'game_id': self._game_id}).encode('utf-8')
+        self._heartbeat_body_md5 = hashlib.md5(self._heartbeat_body_bytes).hexdigest()
         websocket_info = data['websocket_info']
         self._auth_body = websocket_info['auth_body']
+        self._auth_packet = None
         self._host_server_url_list = websocket_info['wss_link']
         anchor_info = data['anchor_info']
         self._room_id = anchor_info['room_id']
@@ -205,7 +227,7 @@ class OpenLiveClient(ws_base.WebSocketClientBase):
                     logger.warning('room=%d _end_game() failed, status=%d, reason=%s',
                                    self._room_id, res.status, res.reason)
                     return False
-                data = await res.json()
+                data = await utils.read_json(res)
                 if data['code'] != 0:
                     logger.warning('room=%d _end_game() failed, code=%d, message=%s, request_id=%s',
                                    self._room_id, data['code'], data['message'], data['request_id'])
@@ -215,18 +237,26 @@ class OpenLiveClient(ws_base.WebSocketClientBase):
             return False
         return True
 
-    def _on_send_game_heartbeat(self):
+    async def _game_heartbeat_loop(self):
         """
-        定时发送项目心跳包的回调
+        定时发送项目心跳包的协程
         """
-        if not self.is_running:
-            self._game_heartbeat_timer_handle = None
-            return
-
-        self._game_heartbeat_timer_handle = asyncio.get_running_loop().call_later(
-            self._game_heartbeat_interval, self._on_send_game_heartbeat
-        )
-        asyncio.create_task(self._send_game_heartbeat())
+        # 下一次心跳的时间在发送前确定，请求耗时不会推迟后面的心跳
+        loop = asyncio.get_running_loop()
+        next_beat = loop.time() + self._game_heartbeat_interval
+        while True:
+            await asyncio.sleep(max(0, next_beat - loop.time()))
+            next_beat = loop.time() + self._game_heartbeat_interval
+            if not self.is_running:
+                self._game_heartbeat_task = None
+                return
+            try:
+                await self._send_game_heartbeat()
+            except asyncio.CancelledError:
+                raise
+            except Exception:  # noqa
+                # 单次心跳失败不能停掉整个循环
+                logger.exception('room=%s _send_game_heartbeat() failed:', self.room_id)
 
     async def _send_game_heartbeat(self):
         """
@@ -237,15 +267,16 @@ class OpenLiveClient(ws_base.WebSocketClientBase):
             return False
 
         try:
-            async with self._request_open_live(
+            async with self._request_open_live_raw(
                 HEARTBEAT_URL,
-                {'game_id': self._game_id}
+                self._heartbeat_body_bytes,
+                self._heartbeat_body_md5
             ) as res:
                 if res.status != 200:
                     logger.warning('room=%d _send_game_heartbeat() failed, status=%d, reason=%s',
                                    self._room_id, res.status, res.reason)
                     return False
-                data = await res.json()
+                data = await utils.read_json(res)
                 if data['code'] != 0:
                     logger.warning('room=%d _send_game_heartbeat() failed, code=%d, message=%s, request_id=%s',
                                    self._room_id, data['code'], data['message'], data['request_id'])
@@ -274,5 +305,7 @@ class OpenLiveClient(ws_base.WebSocketClientBase):
         """
         发送认证包
         """
-        auth_body = json.loads(self._auth_body)
-        await self._websocket.send_bytes(self._make_packet(auth_body, ws_base.Operation.AUTH))
+        if self._auth_packet is None:
+            auth_body = json.loads(self._auth_body)
+            self._auth_packet = self._make_packet(auth_body, ws_base.Operation.AUTH)
+        await self._websocket.send_bytes(self._auth_packet)
@@ -58,6 +58,10 @@ class BLiveClient(ws_base.WebSocketClientBase):
         """
         self._host_server_token: Optional[str] = None
         """连接弹幕服务器用的token"""
+        self._auth_packet_key: Optional[tuple] = None
+        """生成_auth_packet时用的(uid, room_id, buvid, token)"""
+        self._auth_packet: Optional[bytes] = None
+        """缓存的认证包，重连时如果认证参数没变就直接发送"""
 
     @property
     def tmp_room_id(self) -> int:
@@ -107,14 +111,18 @@ class BLiveClient(ws_base.WebSocketClientBase):
         self._host_server_list = None
 
     async def init_session(self):
+        # uid和buvid互不依赖，并发请求
+        init_coros = {}
         if self._uid is None:
-            if not await self._init_uid():
-                logger.warning('room=%d _init_uid() failed', self._tmp_room_id)
-
+            init_coros['_init_uid'] = self._init_uid()
         if self._get_buvid() == '':
-            if not await self._init_buvid():
-                logger.warning('room=%d _init_buvid() failed', self._tmp_room_id)
+            init_coros['_init_buvid'] = self._init_buvid()
+        results = await asyncio.gather(*init_coros.values())
+        for name, ok in zip(init_coros, results):
+            if not ok:
+                logger.warning('room=%d %s() failed', self._tmp_room_id, name)
 
+        # 弹幕服务器的token和当前uid、buvid相关，要等上面完成后再请求
         if not self._host_server_token:
             await self._init_host_server()
 
@@ -127,13 +135,13 @@ class BLiveClient(ws_base.WebSocketClientBase):
         try:
             async with self._session.get(
                 UID_INIT_URL,
-                headers={'User-Agent': utils.USER_AGENT},
+                headers=utils.HEADERS_UA,
             ) as res:
                 if res.status != 200:
                     logger.warning('room=%d _init_uid() failed, status=%d, reason=%s', self._tmp_room_id,
                                    res.status, res.reason)
                     return False
-                data = await res.json()
+                data = await utils.read_json(res)
                 if data['code'] != 0:
                     if data['code'] == -101:
                         # 未登录
@@ -159,7 +167,7 @@ class BLiveClient(ws_base.WebSocketClientBase):
         try:
             async with self._session.get(
                 BUVID_INIT_URL,
-                headers={'User-Agent': utils.USER_AGENT},
+                headers=utils.HEADERS_UA,
             ) as res:
                 if res.status != 200:
                     logger.warning('room=%d _init_buvid() status error, status=%d, reason=%s',
@@ -173,7 +181,7 @@ class BLiveClient(ws_base.WebSocketClientBase):
         try:
             async with self._session.get(
                 ROOM_INIT_URL,
-                headers={'User-Agent': utils.USER_AGENT},
+                headers=utils.HEADERS_UA,
                 params={
                     'room_id': self._tmp_room_id
                 },
@@ -182,7 +190,7 @@ class BLiveClient(ws_base.WebSocketClientBase):
                     logger.warning('room=%d _init_room_id_and_owner() failed, status=%d, reason=%s', self._tmp_room_id,
                                    res.status, res.reason)
                     return False
-                data = await res.json()
+                data = await utils.read_json(res)
                 if data['code'] != 0:
                     logger.warning('room=%d _init_room_id_and_owner() failed, message=%s', self._tmp_room_id,
                                    data['message'])
@@ -204,7 +212,7 @@ class BLiveClient(ws_base.WebSocketClientBase):
         try:
             async with self._session.get(
                 DANMAKU_SERVER_CONF_URL,
-                headers={'User-Agent': utils.USER_AGENT},
+                headers=utils.HEADERS_UA,
                 params={
                     'id': self._room_id,
                     'type': 0
@@ -214,7 +222,7 @@ class BLiveClient(ws_base.WebSocketClientBase):
                     logger.warning('room=%d _init_host_server() failed, status=%d, reason=%s', self._room_id,
                                    res.status, res.reason)
                     return False
-                data = await res.json()
+                data = await utils.read_json(res)
                 if data['code'] != 0:
                     logger.warning('room=%d _init_host_server() failed, message=%s', self._room_id, data['message'])
                     return False
@@ -255,15 +263,22 @@ class BLiveClient(ws_base.WebSocketClientBase):
         """
         发送认证包
         """
-        auth_params = {
-            'uid': self._uid or 0,
-            'roomid': self._room_id,
-            'protover': 3,
-            'buvid': self._get_buvid(),
-            'platform': 'web',
-            'type': 2,
-        }
-        if self._host_server_token is not None:
-            auth_params['key'] = self._host_server_token
-        logger.info(f"room={self._room_id} sending auth {auth_params} with cookies {list(self._session.cookie_jar)}")
-        await self._websocket.send_bytes(self._make_packet(auth_params, ws_base.Operation.AUTH))
+        auth_key = (self._uid or 0, self._room_id, self._get_buvid(), self._host_server_token)
+        if auth_key != self._auth_packet_key:
+            uid, room_id, buvid, token = auth_key
+            auth_params = {
+                'uid': uid,
+                'roomid': room_id,
+                'protover': 3,
+                'buvid': buvid,
+                'platform': 'web',
+                'type': 2,
+            }
+            if token is not None:
+                auth_params['key'] = token
+            logger.info(f"room={self._room_id} sending auth {auth_params} with cookies {list(self._session.cookie_jar)}")
+            self._auth_packet = self._make_packet(auth_params, ws_base.Operation.AUTH)
+            self._auth_packet_key = auth_key
+        else:
+            logger.info(f"room={self._room_id} sending cached auth")
+        await self._websocket.send_bytes(self._auth_packet)
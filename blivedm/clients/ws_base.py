@@ -129,8 +129,8 @@ class WebSocketClientBase:
         """WebSocket连接"""
         self._network_future: Optional[asyncio.Future] = None
         """网络协程的future"""
-        self._heartbeat_timer_handle: Optional[asyncio.TimerHandle] = None
-        """发心跳包定时器的handle"""
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        """定时发心跳包的协程"""
 
     @property
     def cookies(self) -> dict:
@@ -139,8 +139,13 @@ class WebSocketClientBase:
     @cookies.setter
     def cookies(self, new_cookies):
         self._cookies = new_cookies
-        if self.censored and self._own_session:
-            asyncio.ensure_future(self.remake_cookie_session())
+        if self.censored:
+            if self._own_session:
+                asyncio.ensure_future(self.remake_cookie_session())
+            else:
+                # 共享的session由外部负责更新cookie，这里只需要重新获取uid、token
+                self.reset_session()
+                self.censored = False
 
     @property
     def is_running(self) -> bool:
@@ -307,7 +312,7 @@ class WebSocketClientBase:
                 # 连接
                 async with self._session.ws_connect(
                     self._get_ws_url(retry_count),
-                    headers={'User-Agent': utils.USER_AGENT},  # web端的token也会签名UA
+                    headers=utils.HEADERS_UA,  # web端的token也会签名UA
                     receive_timeout=self._heartbeat_interval + 5,
                 ) as websocket:
                     self._websocket = websocket
@@ -354,17 +359,15 @@ class WebSocketClientBase:
         WebSocket连接成功
         """
         await self._send_auth()
-        self._heartbeat_timer_handle = asyncio.get_running_loop().call_later(
-            self._heartbeat_interval, self._on_send_heartbeat
-        )
+        self._heartbeat_task = asyncio.create_task(self._heartbeat_loop())
 
     async def _on_ws_close(self):
         """
         WebSocket连接断开
         """
-        if self._heartbeat_timer_handle is not None:
-            self._heartbeat_timer_handle.cancel()
-            self._heartbeat_timer_handle = None
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
 
     async def _send_auth(self):
         """
@@ -372,18 +375,20 @@ class WebSocketClientBase:
         """
         raise NotImplementedError
 
-    def _on_send_heartbeat(self):
+    async def _heartbeat_loop(self):
         """
-        定时发送心跳包的回调
+        定时发送心跳包的协程
         """
-        if self._websocket is None or self._websocket.closed:
-            self._heartbeat_timer_handle = None
-            return
-
-        self._heartbeat_timer_handle = asyncio.get_running_loop().call_later(
-            self._heartbeat_interval, self._on_send_heartbeat
-        )
-        asyncio.create_task(self._send_heartbeat())
+        # 下一次心跳的时间在发送前确定，发送耗时不会推迟后面的心跳
+        loop = asyncio.get_running_loop()
+        next_beat = loop.time() + self._heartbeat_interval
+        while True:
+            await asyncio.sleep(max(0, next_beat - loop.time()))
+            next_beat = loop.time() + self._heartbeat_interval
+            if self._websocket is None or self._websocket.closed:
+                self._heartbeat_task = None
+                return
+            await self._send_heartbeat()
 
     async def _send_heartbeat(self):
         """
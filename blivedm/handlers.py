@@ -119,16 +119,18 @@ class BaseHandler(HandlerInterface):
         if pos != -1:
             cmd = cmd[:pos]
 
-        if cmd not in self._CMD_CALLBACK_DICT:
+        callback_dict = self._CMD_CALLBACK_DICT
+        callback = callback_dict.get(cmd)
+        if callback is not None:
+            callback(self, client, command)
+            return
+
+        # 值为None的是已知但不处理的cmd
+        if cmd not in callback_dict:
             # 只有第一次遇到未知cmd时打日志
             if cmd not in logged_unknown_cmds:
                 logger.warning('room=%d unknown cmd=%s, command=%s', client.room_id, cmd, command)
                 logged_unknown_cmds.add(cmd)
-            return
-
-        callback = self._CMD_CALLBACK_DICT[cmd]
-        if callback is not None:
-            callback(self, client, command)
 
     def _on_heartbeat(self, client: ws_base.WebSocketClientBase, message: web_models.HeartbeatMessage):
         """
@@ -1,22 +1,43 @@
 import http.cookies
+import json
+from types import MappingProxyType
+from typing import Optional
 
 import aiohttp
 
 USER_AGENT = (
     'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/102.0.0.0 Safari/537.36'
 )
+HEADERS_UA = MappingProxyType({'User-Agent': USER_AGENT})
+"""只带UA的请求头，只读，aiohttp会复制一份再用"""
 
 
-def session_from_cookies(cookies: dict, timeout=10, domain='bilibili.com'):
-    session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=timeout))
+def update_session_cookies(session: aiohttp.ClientSession, cookies: dict, domain='bilibili.com'):
     cookie_jar = http.cookies.SimpleCookie()
     for key, value in cookies.items():
         cookie_jar[key] = value
         cookie_jar[key]['domain'] = domain
     session.cookie_jar.update_cookies(cookie_jar)
+
+
+def session_from_cookies(
+    cookies: dict, timeout=10, domain='bilibili.com', connector: Optional[aiohttp.BaseConnector] = None
+):
+    # 传入的connector可能被多个session共用，由调用者负责关闭
+    session = aiohttp.ClientSession(
+        timeout=aiohttp.ClientTimeout(total=timeout), connector=connector, connector_owner=connector is None
+    )
+    update_session_cookies(session, cookies, domain)
     return session
 
 
+async def read_json(res: aiohttp.ClientResponse):
+    """
+    直接解析响应体，不走aiohttp的编码检测
+    """
+    return json.loads(await res.read())
+
+
 async def validate_cookies(cookies) -> bool:
     async with session_from_cookies(cookies) as session:
         async with session.get('https://api.bilibili.com/x/web-interface/nav') as r:
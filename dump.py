@@ -1,39 +1,81 @@
 #!/usr/bin/env python3
 import time
 import json
+import re
 import logging
 import logging.handlers
 import asyncio
+import atexit
+import queue
+import os
+import random
 from datetime import datetime
-from typing import Dict
+from typing import Dict, Optional
 import sys
 
 import aiofile
+import aiohttp
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 from blivedm.clients import BLiveClient
-from blivedm.utils import validate_cookies
+from blivedm.utils import session_from_cookies, update_session_cookies, validate_cookies
+
+
+logger = logging.getLogger()
+
+MAX_WRITE_BATCH = 256
+ROOM_CHECK_INTERVAL = 60
+COOKIE_CHECK_INTERVAL = 3600
+ROOM_START_INTERVAL = 0.1
+ROOM_ID_RE = re.compile(rb'(?<!\S)[+-]?\d+(?!\S)')
 
 
-logging.basicConfig(
-    level=logging.INFO,
-    handlers=[
+def setup_logging():
+    # 日志的写文件、轮转放在后台线程，避免阻塞事件循环
+    log_queue = queue.SimpleQueue()
+    log_listener = logging.handlers.QueueListener(
+        log_queue,
         logging.StreamHandler(),
-        logging.handlers.RotatingFileHandler('dumper.log', maxBytes=50_000_000, backupCount=3)
-    ]
-)
+        logging.handlers.RotatingFileHandler('dumper.log', maxBytes=50_000_000, backupCount=3),
+    )
+    log_listener.start()
+    atexit.register(log_listener.stop)
 
+    logging.basicConfig(
+        level=logging.INFO,
+        handlers=[logging.handlers.QueueHandler(log_queue)]
+    )
 
-logger = logging.getLogger()
+
+def dump_line(data) -> bytes:
+    # 注意orjson会把NaN、Infinity写成null，标准库会原样写出
+    if orjson is not None:
+        try:
+            return orjson.dumps(data, option=orjson.OPT_APPEND_NEWLINE)
+        except orjson.JSONEncodeError:
+            # 例如超过64位的整数，交给标准库处理
+            pass
+    # 和orjson一样用紧凑格式，保证同一个文件里格式一致
+    return (json.dumps(data, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8')
 
 
-def get_date():
-    return datetime.utcnow().strftime('%y%m%d')
+def get_utc_day() -> int:
+    return int(time.time()) // 86400
+
+
+def format_utc_day(day: int) -> str:
+    return time.strftime('%y%m%d', time.gmtime(day * 86400))
 
 
 class FileWriter:
     def __init__(self, prefix: str) -> None:
         self.prefix = prefix
-        self.date = get_date()
+        self._day = get_utc_day()
+        self.date = format_utc_day(self._day)
         self._write_queue = asyncio.Queue()
         self._writer_future = None
 
@@ -52,64 +94,92 @@ class FileWriter:
     async def _writer(self):
         while True:
             try:
-                self.date = get_date()
-                async with aiofile.async_open(self.fn, 'at', encoding='utf-8') as afp:
-                    while self.date == get_date():
-                        to_write = await asyncio.wait_for(self._write_queue.get(), timeout=300)
-                        await afp.write(to_write)
+                self._day = get_utc_day()
+                self.date = format_utc_day(self._day)
+                async with aiofile.async_open(self.fn, 'ab') as afp:
+                    while self._day == get_utc_day():
+                        batch = [await asyncio.wait_for(self._write_queue.get(), timeout=300)]
+                        # 把队列里积压的数据合并成一次写入
+                        try:
+                            while len(batch) < MAX_WRITE_BATCH:
+                                batch.append(self._write_queue.get_nowait())
+                        except asyncio.QueueEmpty:
+                            pass
+                        await afp.write(b''.join(batch))
             except (asyncio.TimeoutError, asyncio.CancelledError):
                 self._writer_future = None
                 break
             except Exception:
                 logger.exception(f"Failed to write data to file {self.fn}")
 
-    async def write(self, data: list):
-        to_write = json.dumps(data, ensure_ascii=False) + '\n'
-        await self._write_queue.put(to_write)
+    def write(self, data: list):
+        self._write_queue.put_nowait(dump_line(data))
         if not self._writer_future:
             self._writer_future = asyncio.ensure_future(self._writer())
 
 
+class ConsolePrinter:
+    """
+    把要打印的行攒起来，短时间后一次性写到stdout，避免刷屏时每条消息一次系统调用
+    """
+
+    def __init__(self, interval=0.05, max_size=64 * 1024) -> None:
+        self.interval = interval
+        self.max_size = max_size
+        self._lines = []
+        self._size = 0
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+
+    def print(self, *args):
+        line = ' '.join(map(str, args)) + '\n'
+        self._lines.append(line)
+        self._size += len(line)
+        if self._size >= self.max_size:
+            self.flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.interval, self.flush)
+
+    def flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._lines:
+            sys.stdout.write(''.join(self._lines))
+            sys.stdout.flush()
+            self._lines.clear()
+            self._size = 0
+
+
+console = ConsolePrinter()
+
+
 class DumpHandler:
     def __init__(self, prefix='', print=True) -> None:
-        self._dump_queue = asyncio.Queue()
         self._writers: Dict[int, FileWriter] = {}
         self.prefix = prefix
-        self._dispatcher_future = asyncio.ensure_future(self._dispatcher())
 
     @property
     def date(self):
         return datetime.utcnow().strftime('%y%m%d')
 
     async def close(self):
-        self._dispatcher_future.cancel()
-        try:
-            await self._dispatcher_future
-        except asyncio.CancelledError:
-            pass
         await asyncio.gather(*[writer.close() for writer in self._writers.values()])
 
-    async def _dispatcher(self):
-        while True:
-            try:
-                room_id, data = await self._dump_queue.get()
-                if room_id not in self._writers:
-                    self._writers[room_id] = FileWriter(f'{self.prefix}{room_id}')
-                await self._writers[room_id].write(data)
-            except asyncio.CancelledError:
-                break
-            except Exception:
-                logger.exception('Failed to dispatch data to writer')
+    def _get_writer(self, room_id: int) -> FileWriter:
+        writer = self._writers.get(room_id)
+        if writer is None:
+            writer = self._writers[room_id] = FileWriter(f'{self.prefix}{room_id}')
+        return writer
 
     def handle(self, client: BLiveClient, command: dict):
-        cmd = command.get('cmd', '').split(':')[0]
+        cmd = command.get('cmd', '').partition(':')[0]
         room_id = client.room_id or client.tmp_room_id
-        self._dump_queue.put_nowait((room_id, [cmd, time.time(), command]))
+        self._get_writer(room_id).write([cmd, time.time(), command])
 
         if cmd == 'DANMU_MSG':
-            print(room_id, cmd, str(command['info'][1:])[:150])
+            console.print(room_id, cmd, str(command['info'][1:])[:150])
         elif cmd in ['LOG_IN_NOTICE']:
-            print(room_id, cmd, str(command)[:150])
+            console.print(room_id, cmd, str(command)[:150])
 
     def on_stopped_by_exception(self, client: BLiveClient, exception: Exception):
         logger.error(f'room={client.room_id} client exited with error: {exception}')
@@ -125,70 +195,118 @@ async def load_cookies(cookie_fn):
 
 
 async def load_room_ids(room_fn: str):
-    async with aiofile.async_open(room_fn, 'rt', encoding='utf-8') as afp:
-        text: str = await afp.read()
-    room_ids = set()
-    for item in text.split():
-        try:
-            room_ids.add(int(item))
-        except ValueError:
-            pass
-    return room_ids
+    async with aiofile.async_open(room_fn, 'rb') as afp:
+        data: bytes = await afp.read()
+    # 只取以ASCII空白分隔、整段是（可带正负号的）ASCII数字的项，其他内容忽略
+    return {int(item) for item in ROOM_ID_RE.findall(data)}
 
 
 class CookieLoader:
-    def __init__(self, cookie_fn: str, rooms: Dict[int, BLiveClient]):
+    def __init__(self, cookie_fn: str, rooms: Dict[int, BLiveClient], connector: Optional[aiohttp.BaseConnector] = None):
         self.cookie_fn = cookie_fn
         self.rooms = rooms
+        self.connector = connector
+        self.session: Optional[aiohttp.ClientSession] = None
+        self._cookie_mtime: Optional[int] = None
 
     async def init(self):
+        self._cookie_mtime = os.stat(self.cookie_fn).st_mtime_ns
         self.cookies = await load_cookies(self.cookie_fn)
+        self.session = session_from_cookies(self.cookies, connector=self.connector)
         self._runner_future = asyncio.ensure_future(self._runner())
 
+    async def close(self):
+        self._runner_future.cancel()
+        await self.session.close()
+
+    def _apply_cookies(self, cookies: dict):
+        # 和新建session一样，先清掉旧cookie，cookie文件里删掉的项不再保留
+        # buvid3是所有房间共用的，保留下来，避免所有房间重连时同时重新获取
+        kept = {cookie.key: cookie.value for cookie in self.session.cookie_jar if cookie.key == 'buvid3'}
+        self.session.cookie_jar.clear()
+        update_session_cookies(self.session, {**kept, **cookies})
+        for client in self.rooms.values():
+            client.cookies = cookies
+            # 共享session的客户端不会自己检查cookie变化，这里重置uid、token，下次重连时按新cookie重新获取
+            client.reset_session()
+
     async def _runner(self):
+        loop = asyncio.get_running_loop()
         while True:
+            # 加上随机抖动，避免多个实例在同一时刻请求；按截止时间睡眠，不受本轮耗时影响
+            next_check = loop.time() + COOKIE_CHECK_INTERVAL * (0.9 + 0.2 * random.random())
             try:
-                cookies = await load_cookies(self.cookie_fn)
-                if (await validate_cookies(cookies)):
-                    self.cookies = cookies
-                    for client in self.rooms.values():
-                        client.cookies = cookies
+                # 文件没改过就不用重新读取、验证
+                mtime = os.stat(self.cookie_fn).st_mtime_ns
+                if mtime != self._cookie_mtime:
+                    cookies = await load_cookies(self.cookie_fn)
+                    if (await validate_cookies(cookies)):
+                        self._cookie_mtime = mtime
+                        self.cookies = cookies
+                        self._apply_cookies(cookies)
+                    else:
+                        logger.warning('cookies are invalid, skip updating')
                 else:
-                    logger.warning('cookies are invalid, skip updating')
+                    # cookie没变，但被服务器判定未登录的房间仍然需要定时重置，重新获取uid、token
+                    for client in self.rooms.values():
+                        if client.censored:
+                            client.cookies = self.cookies
             except asyncio.CancelledError:
                 break
             except Exception:
                 logger.exception('Failed to load cookies')
-            await asyncio.sleep(3600)
+            await asyncio.sleep(max(0, next_check - loop.time()))
 
 
-async def main(room_fn, cookie_fn):
+async def main(room_fn, cookie_fn, dump_guest=True):
     login_handler = DumpHandler()
     guest_handler = DumpHandler('guest-')
     rooms: Dict[int, BLiveClient] = {}
     guest_rooms: Dict[int, BLiveClient] = {}
 
-    cookie_loader = CookieLoader(cookie_fn, rooms)
+    # 所有房间请求的都是同样几个host，不限制每个host的连接数，省掉按host计数的开销
+    # 每个WebSocket连接都会占用一个连接，所以总数也不限制
+    connector = aiohttp.TCPConnector(limit=0, limit_per_host=0, ttl_dns_cache=300, keepalive_timeout=75)
+    cookie_loader = CookieLoader(cookie_fn, rooms, connector)
     await cookie_loader.init()
+    guest_session = session_from_cookies({}, connector=connector)
     await load_room_ids(room_fn)
 
+    loop = asyncio.get_running_loop()
+    room_mtime = None
+    room_ids = set()
     while True:
+        # 按固定间隔检查房间列表，不受每轮处理耗时影响
+        next_check = loop.time() + ROOM_CHECK_INTERVAL
         try:
-            room_ids = await load_room_ids(room_fn)
-            for room_id in room_ids - set(rooms):
+            # 文件没改过就沿用上次的结果
+            mtime = os.stat(room_fn).st_mtime_ns
+            if mtime != room_mtime:
+                room_ids = await load_room_ids(room_fn)
+                room_mtime = mtime
+            for i, room_id in enumerate(room_ids - set(rooms)):
+                # 错开各房间的启动，避免同时发起大量初始化请求和握手
+                if i:
+                    await asyncio.sleep(ROOM_START_INTERVAL * (0.5 + random.random()))
                 logger.info(f'Starting room={room_id}')
-                rooms[room_id] = BLiveClient(room_id, cookies=cookie_loader.cookies)
+                rooms[room_id] = BLiveClient(room_id, session=cookie_loader.session)
                 rooms[room_id].set_handler(login_handler)
                 rooms[room_id].start()
 
+                # 游客看到的内容由服务器决定，只能另开一个未登录的连接获取
+                if not dump_guest:
+                    continue
                 logger.info(f'Starting guest room={room_id}')
-                guest_rooms[room_id] = BLiveClient(room_id)
+                guest_rooms[room_id] = BLiveClient(room_id, session=guest_session)
                 guest_rooms[room_id].set_handler(guest_handler)
                 guest_rooms[room_id].start()
+            stopping = []
             for room_id in set(rooms) - room_ids:
                 logger.info(f'Stopping room={room_id}')
-                await rooms.pop(room_id).stop_and_close()
-                await guest_rooms.pop(room_id).stop_and_close()
+                stopping.append(rooms.pop(room_id).stop_and_close())
+                if room_id in guest_rooms:
+                    stopping.append(guest_rooms.pop(room_id).stop_and_close())
+            await asyncio.gather(*stopping)
         except KeyboardInterrupt:
             await asyncio.gather(
                 login_handler.close(),
@@ -196,14 +314,19 @@ async def main(room_fn, cookie_fn):
                 *[room.stop_and_close() for room in rooms.values()],
                 *[room.stop_and_close() for room in guest_rooms.values()],
             )
+            await asyncio.gather(cookie_loader.close(), guest_session.close())
+            await connector.close()
+            console.flush()
             break
         except Exception:
             logger.exception('Error while trying to load rooms')
-        print('Running rooms:', rooms.keys(), guest_rooms.keys())
-        await asyncio.sleep(60)
+        console.print('Running rooms:', rooms.keys(), guest_rooms.keys())
+        await asyncio.sleep(max(0, next_check - loop.time()))
 
 
 if __name__ == '__main__':
-    if len(sys.argv) != 3:
-        print(sys.argv[0], '<room_list.txt>', '<cookies.json>')
-    asyncio.run(main(*sys.argv[1:3]))
+    setup_logging()
+    args = [arg for arg in sys.argv[1:] if arg != '--no-guest']
+    if len(args) != 2:
+        print(sys.argv[0], '<room_list.txt>', '<cookies.json>', '[--no-guest]')
+    asyncio.run(main(*args[:2], dump_guest='--no-guest' not in sys.argv[1:]))